@@ -6,43 +6,54 @@
 # - Tab 3: Nieuwe rijen t.o.v. oud met Delay (days) > 0
 # ------------------------------------------------------------
 
+import datetime
 import io
 import math
+import os
 import re
+import sys
 import traceback
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from tempfile import NamedTemporaryFile
 from typing import List, Tuple
+from xml.sax.saxutils import escape
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 
 # ---------- Helpers ----------
+_ITEM_ALIASES = {"item number", "itemnumber", "item no", "item_no", "itemnr", "item"}
+_DELAY_ALIASES = {"delay(days)", "delay (days)", "delay_days", "delay", "vertraging(dagen)", "vertraging (dagen)"}
+_ALIAS_LOOKUP = {
+    **dict.fromkeys(_ITEM_ALIASES, "Item number"),
+    **dict.fromkeys(_DELAY_ALIASES, "Delay (days)"),
+    "number": "Number",
+}
+
 def _norm_key_name(name: str) -> str:
     if name is None:
         return ""
     s = str(name).replace("\xa0", " ")
     s = " ".join(s.split()).strip().lower()
-    s = re.sub(r"\s*\(\s*", "(", s)
-    s = re.sub(r"\s*\)\s*", ")", s)
-    return s
+    # Na het samenvoegen staat er hoogstens één spatie rond een haakje
+    return s.replace(" (", "(").replace("( ", "(").replace(" )", ")").replace(") ", ")")
 
 def _canon_columns(df: pd.DataFrame) -> pd.DataFrame:
     """Normaliseer kolomnamen. 'Number' losse kolom; 'Item number' is key; 'Delay (days)' voor filter."""
     rename_map = {}
     for col in df.columns:
-        k = _norm_key_name(col)
-        if k in {"item number", "itemnumber", "item no", "item_no", "itemnr", "item"}:
-            rename_map[col] = "Item number"
-        elif k in {"delay(days)", "delay (days)", "delay_days", "delay", "vertraging(dagen)", "vertraging (dagen)"}:
-            rename_map[col] = "Delay (days)"
-        elif k == "number":
-            rename_map[col] = "Number"
+        target = _ALIAS_LOOKUP.get(_norm_key_name(col))
+        if target:
+            rename_map[col] = target
     return df.rename(columns=rename_map)
 
 def _ensure_item_number(df: pd.DataFrame) -> pd.DataFrame:
     """Fallback: als 'Item number' ontbreekt maar 'Number' bestaat, kopieer die naar 'Item number'."""
     if "Item number" not in df.columns and "Number" in df.columns:
-        df = df.copy()
-        df["Item number"] = df["Number"]
+        df = df.assign(**{"Item number": df["Number"]})
     return df
 
 def _clean_key_value(v) -> str:
@@ -53,11 +64,28 @@ def _clean_key_value(v) -> str:
         return str(int(v))
     return str(v).strip()
 
+def _clean_key_series(s: pd.Series) -> pd.Series:
+    """Gevectoriseerde _clean_key_value; gemengde object-kolommen vallen terug op de per-cel variant."""
+    kind = s.dtype.kind
+    if kind in "iu":
+        return s.astype(str).where(s.notna(), "")
+    if kind == "f":
+        out = s.astype(str)
+        whole = np.isfinite(s) & (s % 1 == 0)
+        small = whole & (s.abs() < 2**63)
+        out[small] = s[small].astype("int64").astype(str)
+        if (whole & ~small).any():  # buiten int64-bereik: per cel
+            out[whole & ~small] = s[whole & ~small].map(_clean_key_value)
+        return out.where(s.notna(), "")
+    if pd.api.types.infer_dtype(s, skipna=True) in {"string", "empty"}:
+        return s.astype("string").str.strip().fillna("")
+    return s.map(_clean_key_value)
+
 def _prepare(df_old: pd.DataFrame, df_new: pd.DataFrame, key: str
 ) -> Tuple[pd.DataFrame, pd.DataFrame, List[str]]:
     """Normaliseer, dedupliceer op key en aligneer kolommen (indexeer op key)."""
-    df_old = _ensure_item_number(_canon_columns(df_old.copy()))
-    df_new = _ensure_item_number(_canon_columns(df_new.copy()))
+    df_old = _ensure_item_number(_canon_columns(df_old))
+    df_new = _ensure_item_number(_canon_columns(df_new))
 
     if key not in df_old.columns or key not in df_new.columns:
         raise KeyError(
@@ -66,107 +94,296 @@ def _prepare(df_old: pd.DataFrame, df_new: pd.DataFrame, key: str
             f"Nieuw kolommen: {list(df_new.columns)}"
         )
 
-    df_old[key] = df_old[key].map(_clean_key_value)
-    df_new[key] = df_new[key].map(_clean_key_value)
+    # assign i.p.v. kolom-toewijzing: het frame van de aanroeper blijft onaangeroerd.
+    # Arrow-strings als key: index-hashing/difference/.loc zonder Python-objecten.
+    df_old = df_old.assign(**{key: _clean_key_series(df_old[key]).astype("string[pyarrow]")})
+    df_new = df_new.assign(**{key: _clean_key_series(df_new[key]).astype("string[pyarrow]")})
 
-    df_old = df_old.drop_duplicates(subset=[key], keep="last")
-    df_new = df_new.drop_duplicates(subset=[key], keep="last")
+    # Dedupliceer via de index: één hashtable-pass over de key i.p.v. een frame-brede hash
+    df_old = df_old.set_index(key)
+    df_new = df_new.set_index(key)
+    df_old = df_old[~df_old.index.duplicated(keep="last")]
+    df_new = df_new[~df_new.index.duplicated(keep="last")]
 
-    common_cols = sorted(set(df_new.columns).intersection(df_old.columns))
-    if key in common_cols:
-        common_cols = [key] + [c for c in common_cols if c != key]
+    # Volgorde van het nieuwe bestand aanhouden (zoals de gebruiker het in Excel ziet)
+    old_cols = set(df_old.columns)
+    common_cols = list(dict.fromkeys(c for c in df_new.columns if c in old_cols))
 
-    df_old = df_old[common_cols].set_index(key)
-    df_new = df_new[common_cols].set_index(key)
-    return df_old, df_new, common_cols
+    df_old = df_old[common_cols]
+    df_new = df_new[common_cols]
+    return df_old, df_new, [key] + common_cols
 
 def _new_rows_with_delay(df_old_idx: pd.DataFrame, df_new_idx: pd.DataFrame) -> pd.DataFrame:
     """Nieuwe Item numbers t.o.v. oud, daarna filter op Delay (days) > 0 (indien kolom bestaat)."""
-    added_keys = sorted(set(df_new_idx.index) - set(df_old_idx.index))
-    if not added_keys:
-        cols = ["Item number"] + [c for c in df_new_idx.columns if c != "Item number"]
-        return pd.DataFrame(columns=cols)
-    df_added = df_new_idx.loc[added_keys].copy()
-    if "Delay (days)" in df_added.columns:
-        df_added["Delay (days)"] = pd.to_numeric(df_added["Delay (days)"], errors="coerce").fillna(0)
-        df_added = df_added[df_added["Delay (days)"] > 0]
-    return df_added.reset_index()
+    # Eén booleaanse mask over het nieuwe frame, één gather; volgorde van het nieuwe bestand
+    mask = ~df_new_idx.index.isin(df_old_idx.index)
+    if "Delay (days)" in df_new_idx.columns:
+        delay = pd.to_numeric(df_new_idx["Delay (days)"], errors="coerce").fillna(0)
+        mask &= (delay > 0).to_numpy()
+        return df_new_idx.loc[mask].assign(**{"Delay (days)": delay[mask]}).reset_index()
+    return df_new_idx.loc[mask].reset_index()
+
+# ---------- Excel import ----------
+def _read_xlsx(buf) -> pd.DataFrame:
+    """Lees het eerste tabblad; calamine (Rust) indien beschikbaar, anders openpyxl."""
+    try:
+        return pd.read_excel(buf, engine="calamine")
+    except (ImportError, ValueError):
+        # Oudere pandas (<2.2) of python-calamine niet geïnstalleerd
+        if hasattr(buf, "seek"):
+            buf.seek(0)
+        # pandas opent openpyxl al read_only/data_only en trimt lege rijen/dubbele headers
+        return pd.read_excel(buf, engine="openpyxl")
+
+def _load_xlsx(file_bytes: bytes) -> pd.DataFrame:
+    return _read_xlsx(io.BytesIO(file_bytes))
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _load_and_prepare(old_bytes: bytes, new_bytes: bytes, key: str
+) -> Tuple[pd.DataFrame, pd.DataFrame, List[str]]:
+    """_prepare gecachet op de inhoud van beide bestanden (alleen de laatste paar uploads);
+    beide xlsx'en worden parallel ingelezen. De ruwe frames worden bewust niet gecachet."""
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        f_old = ex.submit(_load_xlsx, old_bytes)
+        f_new = ex.submit(_load_xlsx, new_bytes)
+        df_old_raw, df_new_raw = f_old.result(), f_new.result()
+    return _prepare(df_old_raw, df_new_raw, key)
 
 # ---------- Excel-safe kolomnamen ----------
-_excel_bad_chars = re.compile(r"[\[\]\:\*\?\\/]")
+_BAD_TABLE = str.maketrans({c: "_" for c in "[]:*?\\/"})
 def _excel_safe_headers(df: pd.DataFrame) -> pd.DataFrame:
     """
     Maak kolomnamen Excel-table-proof:
     - niet leeg
-    - unieke namen
+    - unieke namen (hoofdletterongevoelig, zoals Excel en xlsxwriter ze vergelijken)
     - geen problematische tekens
     """
     cols_out = []
     seen = set()
+    counts = {}
     for i, c in enumerate(df.columns, start=1):
         name = str(c) if c is not None else ""
         name = name.strip()
         if name == "":
             name = f"Column{i}"
-        name = _excel_bad_chars.sub("_", name)
-        base = name
-        n = 1
-        while name in seen:
+        base = name.translate(_BAD_TABLE)
+        # Teller per basisnaam; de while vangt alleen botsingen met bv. een bestaande 'x_2'
+        key = base.casefold()
+        n = counts.get(key, 0) + 1
+        name = base if n == 1 else f"{base}_{n}"
+        while name.casefold() in seen:
             n += 1
             name = f"{base}_{n}"
-        seen.add(name)
+        counts[key] = n
+        seen.add(name.casefold())
         cols_out.append(name)
-    out = df.copy()
+    # Ondiepe kopie: alleen de kolomnamen wijzigen, de data wordt niet gekopieerd
+    out = df.copy(deep=False)
     out.columns = cols_out
     return out
 
+_table_counter = count(1)
 def _safe_table_name(sheet_title: str) -> str:
     """Excel Table displayName: letters/nummers/underscore, start met letter, max ~100 chars."""
     base = re.sub(r"[^A-Za-z0-9_]", "_", sheet_title)  # vervang () > etc.
     if not base or not base[0].isalpha():
         base = "T_" + base
     base = base[:80]  # houd het kort
-    from uuid import uuid4
-    return f"{base}_{str(uuid4())[:8]}"
+    return f"{base}_{next(_table_counter)}"
+
+# ---------- Excel export: directe XML (snel pad voor grote exports) ----------
+_RAW_XML_MIN_ROWS = 50_000  # vanaf dit totaal aantal rijen de xlsx-XML zelf schrijven
+_xml_bad_chars = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+_EXCEL_EPOCH = pd.Timestamp("1899-12-30")
+_NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+_CT_BASE = "application/vnd.openxmlformats-officedocument.spreadsheetml"
+_EXCEL_MAX_ROWS, _EXCEL_MAX_COLS, _EXCEL_MAX_STR = 1_048_576, 16_384, 32_767
+_FREE_THREADED = not getattr(sys, "_is_gil_enabled", lambda: True)()  # Python 3.13t+
+
+def _xml_text(v) -> str:
+    # \r expliciet: parsers maken van een losse CR in tekst anders een \n
+    return escape(_xml_bad_chars.sub("", str(v)), {'"': "&quot;", "\r": "&#xD;"})
+
+def _xml_attr(v) -> str:
+    """Als _xml_text, maar ook witruimte escapen: parsers normaliseren die in attributen naar spaties."""
+    return escape(_xml_bad_chars.sub("", str(v)), {'"': "&quot;", "\n": "&#xA;", "\r": "&#xD;", "\t": "&#x9;"})
+
+def _col_letter(n: int) -> str:
+    """1 -> 'A', 27 -> 'AA'."""
+    s = ""
+    while n:
+        n, r = divmod(n - 1, 26)
+        s = chr(65 + r) + s
+    return s
+
+def _xml_str_cell(v) -> str:
+    # Afkappen op Excels maximum per cel, net als xlsxwriter
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{_xml_text(str(v)[:_EXCEL_MAX_STR])}</t></is></c>'
+
+def _xml_cell(v) -> str:
+    """Eén cel als XML; NaN/None/NaT -> lege cel, datums als Excel-serienummer (stijl 1)."""
+    if v is None or v is pd.NA or v is pd.NaT:
+        return "<c/>"
+    if isinstance(v, (bool, np.bool_)):
+        return f'<c t="b"><v>{int(v)}</v></c>'
+    if isinstance(v, (int, np.integer)):
+        return f"<c><v>{int(v)}</v></c>"
+    if isinstance(v, (float, np.floating)):
+        # float(): repr van een numpy-scalar is onder numpy 2 'np.float64(1.5)'
+        return f"<c><v>{float(v)!r}</v></c>" if math.isfinite(v) else "<c/>"
+    if isinstance(v, (datetime.datetime, datetime.date)):
+        ts = pd.Timestamp(v).tz_localize(None) if isinstance(v, datetime.datetime) and v.tzinfo else pd.Timestamp(v)
+        return f'<c s="1"><v>{(ts - _EXCEL_EPOCH) / pd.Timedelta(days=1)!r}</v></c>'
+    return _xml_str_cell(v)
+
+def _xml_cells(col: pd.Series) -> List[str]:
+    """Preformatteer een hele kolom; numerieke kolommen zonder per-cel type-dispatch."""
+    kind = col.dtype.kind
+    if not isinstance(col.dtype, np.dtype):  # nullable/extension dtypes (pd.NA, tz-aware datums): per cel
+        return [_xml_cell(v) for v in col.tolist()]
+    if kind == "M":
+        days = ((col - _EXCEL_EPOCH) / pd.Timedelta(days=1)).tolist()
+        return [f'<c s="1"><v>{v!r}</v></c>' if math.isfinite(v) else "<c/>" for v in days]
+    if kind in "iu":
+        return [f"<c><v>{v}</v></c>" for v in col.tolist()]
+    if kind == "f":
+        return [f"<c><v>{v!r}</v></c>" if math.isfinite(v) else "<c/>" for v in col.tolist()]
+    return [_xml_cell(v) for v in col.tolist()]
+
+def _xml_sheet(df: pd.DataFrame, with_table: bool) -> bytes:
+    out = io.BytesIO()
+    out.write(f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+              f'<worksheet xmlns="{_NS_MAIN}" xmlns:r="{_NS_REL}"><sheetData>'.encode())
+    out.write(("<row>" + "".join(_xml_str_cell(h) for h in df.columns) + "</row>").encode())
+    for cells in zip(*(_xml_cells(df[c]) for c in df.columns)):
+        out.write(("<row>" + "".join(cells) + "</row>").encode())
+    out.write(b"</sheetData>")
+    if with_table:
+        out.write(b'<tableParts count="1"><tablePart r:id="rId1"/></tableParts>')
+    out.write(b"</worksheet>")
+    return out.getvalue()
+
+def _xml_table(df: pd.DataFrame, n: int, table_name: str) -> bytes:
+    ref = f"A1:{_col_letter(len(df.columns))}{len(df) + 1}"
+    cols = "".join(f'<tableColumn id="{i}" name="{_xml_attr(h)}"/>' for i, h in enumerate(df.columns, start=1))
+    return (
+        f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        f'<table xmlns="{_NS_MAIN}" id="{n}" name="{table_name}" displayName="{table_name}" ref="{ref}">'
+        f'<autoFilter ref="{ref}"/><tableColumns count="{len(df.columns)}">{cols}</tableColumns>'
+        f'<tableStyleInfo name="TableStyleMedium9" showFirstColumn="0" showLastColumn="0" '
+        f'showRowStripes="1" showColumnStripes="0"/></table>'
+    ).encode()
+
+def _write_sheet(df: pd.DataFrame, n: int, table_name: str) -> Tuple[bytes, bytes]:
+    """sheet{n}.xml en table{n}.xml voor één tabblad; table is b"" als er geen tabel komt."""
+    # Excel vereist minimaal header + 1 datarij
+    with_table = len(df) >= 1 and len(df.columns) >= 1
+    return _xml_sheet(df, with_table), (_xml_table(df, n, table_name) if with_table else b"")
+
+def _to_excel_raw_xml(dfs: List[pd.DataFrame], sheet_names: List[str], table_names: List[str], target) -> None:
+    """Schrijf de xlsx-onderdelen (sheets, tables, rels) rechtstreeks en zip ze naar target (pad of bestand)."""
+    header = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    overrides, sheets, wb_rels = [], [], []
+    for df in dfs:
+        # Zelfde controle als pandas' to_excel (plus de headerrij, die hier ook een rij is)
+        if len(df) + 1 > _EXCEL_MAX_ROWS or len(df.columns) > _EXCEL_MAX_COLS:
+            raise ValueError(
+                f"This sheet is too large! Your sheet size is: {len(df)}, {len(df.columns)} "
+                f"Max sheet size is: {_EXCEL_MAX_ROWS}, {_EXCEL_MAX_COLS}"
+            )
+    numbers = range(1, len(dfs) + 1)
+    # Tabbladen zijn onafhankelijk: parallel serialiseren levert alleen winst zonder GIL.
+    # Anders lui: per tabblad bouwen en direct zippen, zodat er maar één sheet-XML in geheugen staat.
+    if _FREE_THREADED and len(dfs) > 1:
+        with ThreadPoolExecutor(max_workers=len(dfs)) as ex:
+            parts = list(ex.map(_write_sheet, dfs, numbers, table_names))
+    else:
+        parts = map(_write_sheet, dfs, numbers, table_names)
+
+    with zipfile.ZipFile(target, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        for n, sheet, (sheet_xml, table_xml) in zip(numbers, sheet_names, parts):
+            zf.writestr(f"xl/worksheets/sheet{n}.xml", sheet_xml)
+            overrides.append(f'<Override PartName="/xl/worksheets/sheet{n}.xml" ContentType="{_CT_BASE}.worksheet+xml"/>')
+            sheets.append(f'<sheet name="{_xml_attr(sheet)}" sheetId="{n}" r:id="rId{n}"/>')
+            wb_rels.append(f'<Relationship Id="rId{n}" Type="{_NS_REL}/worksheet" Target="worksheets/sheet{n}.xml"/>')
+            if table_xml:
+                zf.writestr(f"xl/tables/table{n}.xml", table_xml)
+                zf.writestr(
+                    f"xl/worksheets/_rels/sheet{n}.xml.rels",
+                    f'{header}<Relationships xmlns="{_NS_PKG_REL}">'
+                    f'<Relationship Id="rId1" Type="{_NS_REL}/table" Target="../tables/table{n}.xml"/></Relationships>',
+                )
+                overrides.append(f'<Override PartName="/xl/tables/table{n}.xml" ContentType="{_CT_BASE}.table+xml"/>')
+        wb_rels.append(f'<Relationship Id="rId{len(dfs) + 1}" Type="{_NS_REL}/styles" Target="styles.xml"/>')
+
+        zf.writestr(
+            "[Content_Types].xml",
+            f'{header}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            f'<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            f'<Default Extension="xml" ContentType="application/xml"/>'
+            f'<Override PartName="/xl/workbook.xml" ContentType="{_CT_BASE}.sheet.main+xml"/>'
+            f'<Override PartName="/xl/styles.xml" ContentType="{_CT_BASE}.styles+xml"/>'
+            f'{"".join(overrides)}</Types>',
+        )
+        zf.writestr(
+            "_rels/.rels",
+            f'{header}<Relationships xmlns="{_NS_PKG_REL}">'
+            f'<Relationship Id="rId1" Type="{_NS_REL}/officeDocument" Target="xl/workbook.xml"/></Relationships>',
+        )
+        zf.writestr(
+            "xl/workbook.xml",
+            f'{header}<workbook xmlns="{_NS_MAIN}" xmlns:r="{_NS_REL}"><sheets>{"".join(sheets)}</sheets></workbook>',
+        )
+        zf.writestr("xl/_rels/workbook.xml.rels", f'{header}<Relationships xmlns="{_NS_PKG_REL}">{"".join(wb_rels)}</Relationships>')
+        # Stijl 0 = standaard, stijl 1 = datum/tijd (zelfde notatie als pandas' export)
+        zf.writestr(
+            "xl/styles.xml",
+            f'{header}<styleSheet xmlns="{_NS_MAIN}">'
+            f'<numFmts count="1"><numFmt numFmtId="164" formatCode="yyyy-mm-dd hh:mm:ss"/></numFmts>'
+            f'<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+            f'<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+            f'<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+            f'<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+            f'<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+            f'<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+            f'<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+            f'</styleSheet>',
+        )
 
 # ---------- Excel export (mét Tables, veilig) ----------
 def to_excel_bytes(df_old_idx, df_new_idx, df_added_delay) -> bytes:
-    from openpyxl import load_workbook
-    from openpyxl.worksheet.table import Table, TableStyleInfo
-    from openpyxl.utils import get_column_letter
-
     # Alleen voor export: headers Excel-proof maken
-    df_old_out = _excel_safe_headers(df_old_idx.reset_index())
-    df_new_out = _excel_safe_headers(df_new_idx.reset_index())
-    df_add_out = _excel_safe_headers(df_added_delay)
-
-    buf = io.BytesIO()
-    with pd.ExcelWriter(buf, engine="openpyxl") as xw:
-        df_old_out.to_excel(xw, sheet_name="Oude_invoer", index=False)
-        df_new_out.to_excel(xw, sheet_name="Nieuwe_invoer", index=False)
-        df_add_out.to_excel(xw, sheet_name="Nieuwe_rijen_Delay_gt_0", index=False)
-    buf.seek(0)
-
-    wb = load_workbook(buf)
-
-    def add_table(ws):
-        # Excel vereist minimaal header + 1 datarij
-        if ws.max_row >= 2 and ws.max_column >= 1:
-            last_row = ws.max_row
-            last_col_letter = get_column_letter(ws.max_column)
-            ref = f"A1:{last_col_letter}{last_row}"
-            tname = _safe_table_name(ws.title)
-            t = Table(displayName=tname, ref=ref)
-            t.tableStyleInfo = TableStyleInfo(name="TableStyleMedium9", showRowStripes=True)
-            ws.add_table(t)
-
-    for s in ["Oude_invoer", "Nieuwe_invoer", "Nieuwe_rijen_Delay_gt_0"]:
-        add_table(wb[s])
+    dfs = [
+        _excel_safe_headers(df_old_idx.reset_index()),
+        _excel_safe_headers(df_new_idx.reset_index()),
+        _excel_safe_headers(df_added_delay),
+    ]
+    sheet_names = ["Oude_invoer", "Nieuwe_invoer", "Nieuwe_rijen_Delay_gt_0"]
+    table_names = [_safe_table_name(s) for s in sheet_names]
 
-    out = io.BytesIO()
-    wb.save(out)
-    out.seek(0)
-    return out.read()
+    # Schrijf naar een tijdelijk bestand i.p.v. BytesIO: zo staat de xlsx maar één keer in het geheugen
+    with NamedTemporaryFile(suffix=".xlsx", delete=False) as tf:
+        path = tf.name
+    try:
+        if sum(len(df) for df in dfs) >= _RAW_XML_MIN_ROWS:
+            _to_excel_raw_xml(dfs, sheet_names, table_names, path)
+        else:
+            with pd.ExcelWriter(path, engine="xlsxwriter") as xw:
+                for df, sheet, tname in zip(dfs, sheet_names, table_names):
+                    df.to_excel(xw, sheet_name=sheet, index=False)
+                    # Excel vereist minimaal header + 1 datarij
+                    if len(df) >= 1 and len(df.columns) >= 1:
+                        xw.sheets[sheet].add_table(0, 0, len(df), len(df.columns) - 1, {
+                            "name": tname,
+                            "columns": [{"header": h} for h in df.columns],
+                            "style": "Table Style Medium 9",
+                        })
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.unlink(path)
 
 # ---------- Streamlit UI ----------
 st.set_page_config(page_title="Inkoop vergelijkingstool", layout="centered")
@@ -184,10 +401,9 @@ if st.button("Vergelijk", type="primary", use_container_width=True):
 
     try:
         with st.spinner("Bezig met vergelijken…"):
-            df_old_raw = pd.read_excel(file_old)
-            df_new_raw = pd.read_excel(file_new)
-
-            df_old_idx, df_new_idx, _ = _prepare(df_old_raw, df_new_raw, key="Item number")
+            df_old_idx, df_new_idx, _ = _load_and_prepare(
+                file_old.getvalue(), file_new.getvalue(), key="Item number"
+            )
             df_added_delay = _new_rows_with_delay(df_old_idx, df_new_idx)
 
         tabs = st.tabs(["Oude invoer", "Nieuwe invoer", "Nieuwe rijen (Delay>0)"])